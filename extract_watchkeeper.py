@@ -1,42 +1,61 @@
-from pdf2image import convert_from_path
+import pymupdf
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pdfminer.high_level import extract_text
 import re
 
+# Patterns of the values read from the text of each page
+_RE_VESSEL = re.compile(r'Vessel:\n\n(.*?)\n')
+_RE_SEAFARER = re.compile(r'Seafarer \(Full Name\):\n\n(.*?)\n')
+_RE_POSITION = re.compile(r'Position \(Rank\):\n\n(.*?)\n')
+_RE_PERIOD = re.compile(r'\n(.*)\n\nPeriods')
+_RE_STARTDAY = re.compile(r'Date\n(\d\d)/')
+_RE_ENDDAY = re.compile(r'\n(\d\d)/\d\d/\d{4}\n\n')
+_RE_PAGE = re.compile(r'Page *(.*?) ')
+_RE_HOURSOFREST24 = re.compile(r'in any 24h\n([\s\S]+?)\n\n')
+_RE_HOURSOFREST7 = re.compile(r'in any 7d\n([\s\S]+?)\n\n')
+
+# Resolution the pages are rendered at, the sample positions in get_ganttdata are pixels at this resolution
+_DPI = 100
+
+# Sample positions (x, y) of the half-hour cells at _DPI, 48 cells per day and one row of cells for each day of a month
+_ALL_X = np.array([144,152,164,172,183,192,203,211,222,230,242,250,262,270,282,290,301,310,322,329,341,349,360,368,380,388,399,407,420,426,438,447,458,466,478,486,498,506,518,526,537,545,557,565,576,585,596,604], dtype=np.int32)
+_ALL_Y = 178 + 13 * np.arange(31, dtype=np.int32)
+
+# The PDF document of a page worker process, opened by _open_document
+_document = None
+
 
 def get_ganttdata(image, days):
     """
     Extracts gantt data (worker schedules) from an image.
 
     Args:
-        image (PIL.Image.Image): The input image.
+        image (PIL.Image.Image or numpy.ndarray): The input image rendered at 100 dpi, or its pixels as a grayscale array of shape (height, width).
         days (int): The number of days to extract gantt data for.
 
     Returns:
         pandas.DataFrame: A DataFrame 48x(number of days) containing the gantt data, 0 meaning rest, 1 meaning work hours.
     """
-    # Convert the image to RGB
-    image = image.convert('RGB')
+    # Convert the image to a grayscale array, one byte per pixel
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert('L'))
 
-    # Get the color value of the pixel at a certain position (x, y)
-    y = 348
-    all_x = [288,303,327,343,366,383,406,422,445,461,484,500,523,540,563,579,602,619,643,658,682,698,721,736,760,776,798,814,839,853,877,894,917,932,957,972,996,1012,1036,1051,1074,1090,1114,1130,1153,1170,1193,1208]
+    # Sample positions (x, y) of the half-hour cells, one row of cells per day
+    xs = _ALL_X
+    ys = _ALL_Y[:days]
+    assert ys[-1] < image.shape[0] and xs[-1] < image.shape[1], 'The image is too small for the sample positions, render it at 100 dpi'
 
-    gantts = []
-
-    for i in range(days):  
-        gantt = []
-        for x in all_x:
-            r0, g0, b0 = image.getpixel((x, y))
+    # Read the gray values of all sample positions at once, shape (days, 48)
+    pixels = image[ys[:, None], xs[None, :]]
 
-            if r0 != 255 and g0 != 255 and b0 != 255:
-                gantt.append(1)
-            else:
-                gantt.append(0)
-        y += 26
-        gantts.append(gantt)
+    # A cell is shaded (work) when it is not white
+    gantts = (pixels < 255).astype(np.uint8)
 
     gantts = pd.DataFrame(gantts)
     return gantts
@@ -86,10 +105,70 @@ def export(gantts):
         # Write the DataFrame to a new sheet in the Excel file
         df.to_excel(writer, sheet_name='Page' + str(i + 1), index=False)
 
-    writer.save()
+    writer.close()
     return
 
 
+def _open_document(file):
+    """
+    Opens the PDF file in a page worker process, once for all the pages the worker processes.
+
+    Args:
+        file (str): The path to the PDF file.
+    """
+    global _document
+    _document = pymupdf.open(file)
+
+
+def _process_page(args):
+    """
+    Extracts the header, hours of rest and gantt data of a single page.
+
+    Args:
+        args (tuple): A tuple of the page number and the page text.
+
+    Returns:
+        dict: A dictionary with the 'header' and 'anyhours' values of the page and its 'gantt' data.
+    """
+    pagenumber, text = args
+
+    vessel = _RE_VESSEL.search(text)
+    seafarer = _RE_SEAFARER.search(text)
+    position = _RE_POSITION.search(text)
+    period = _RE_PERIOD.search(text)
+    startday = _RE_STARTDAY.search(text)
+    endday = _RE_ENDDAY.search(text)
+    page = _RE_PAGE.search(text)
+
+    header = {
+        'Vessel': vessel.group(1),
+        'Seafarer': seafarer.group(1),
+        'Position': position.group(1),
+        'Period': period.group(1),
+        'StartDay': int(startday.group(1)),
+        'EndDay': int(endday.group(1)),
+        'Page': page.group(1),
+    }
+
+    hoursofrest24 = _RE_HOURSOFREST24.search(text)
+    hoursofrest7 = _RE_HOURSOFREST7.search(text)
+
+    anyhours = {
+        'Hours of rest in any 24h': hoursofrest24.group(1).split('\n'),
+        'Hours of rest in any 7d': hoursofrest7.group(1).split('\n'),
+    }
+
+    # Convert the page to an image at the resolution of the sample positions of get_ganttdata
+    pixmap = _document[pagenumber].get_pixmap(dpi=_DPI, colorspace=pymupdf.csGRAY)
+
+    # View the pixmap samples as a grayscale array without copying them into a PIL image
+    image = np.frombuffer(pixmap.samples_mv, dtype=np.uint8).reshape(pixmap.height, pixmap.width)
+
+    gantt = get_ganttdata(image, header['EndDay'] - header['StartDay'] + 1)
+
+    return {'header': header, 'anyhours': anyhours, 'gantt': gantt}
+
+
 def read_pdf(file):
     """
     Reads a PDF file, extracts information, and returns the extracted data.
@@ -103,12 +182,9 @@ def read_pdf(file):
             - header (pandas.DataFrame): A DataFrame containing header information extracted from the PDF.
             This includes the vessel, seafarer, position, period, start day, end day, and page.
             - anyhours (dict): A dictionary containing information about hours of rest in any 24 hours and any 7 days.
-            - hoursworkedinaday (list): A list of lists containing the number of hours worked in each day.
+            - hoursworkedinaday (pandas.DataFrame): A DataFrame containing the number of hours worked in each day, one row per page.
 
     """
-    # Convert the PDF to an image
-    images = convert_from_path(file)
-
     # Extract text from the PDF
     text = extract_text(file)
 
@@ -119,45 +195,34 @@ def read_pdf(file):
 
     gantts = []
 
-    for i in range(len(split_text)):
-        vessel = re.search(r'Vessel:\n\n(.*?)\n', split_text[i])
-        seafarer = re.search(r'Seafarer \(Full Name\):\n\n(.*?)\n', split_text[i])
-        position = re.search(r'Position \(Rank\):\n\n(.*?)\n', split_text[i])
-        period = re.search(r'\n(.*)\n\nPeriods', split_text[i])
-        startday = re.search(r'Date\n(\d\d)/', split_text[i])
-        endday = re.search(r'\n(\d\d)/\d\d/\d{4}\n\n', split_text[i])
-        page = re.search(r'Page *(.*?) ', split_text[i])
-
-        header['Vessel'].append(vessel.group(1))
-        header['Seafarer'].append(seafarer.group(1))
-        header['Position'].append(position.group(1))
-        header['Period'].append(period.group(1))
-        header['StartDay'].append(int(startday.group(1)))
-        header['EndDay'].append(int(endday.group(1)))
-        header['Page'].append(page.group(1))
-
-        hoursofrest24 = re.search(r'in any 24h\n([\s\S]+?)\n\n', split_text[i])
-        hoursofrest7 = re.search(r'in any 7d\n([\s\S]+?)\n\n', split_text[i])
-
-        anyhours['Hours of rest in any 24h'].append(hoursofrest24.group(1).split('\n'))
-        anyhours['Hours of rest in any 7d'].append(hoursofrest7.group(1).split('\n'))
+    # Process the pages in parallel, one worker per CPU. Each worker opens the PDF once and renders
+    # its own pages, so only one page image per worker is held in memory at a time
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_open_document, initargs=(file,)) as pool:
+        pages = list(pool.map(_process_page, [(i, split_text[i]) for i in range(len(split_text))]))
 
+    for pageinfo in pages:
+        for key in header.keys():
+            header[key].append(pageinfo['header'][key])
         for key in anyhours.keys():
-            for i in range(len(anyhours[key])):
-                anyhours[key][i] = [float(x) if x != 'N/A' else 'N/A' for x in anyhours[key][i]]
-        
-        gantt = get_ganttdata(images[i], header['EndDay'][i] - header['StartDay'][i] + 1)
-        gantts.append(gantt)
-    
-    hoursworkedinaday = []
-    for gantt in gantts:
-        hoursworked = []
-        gantt = gantt.T
-        
-        for days in range(len(gantt.T)):
-            hoursworked.append(gantt[days][gantt[days] == 1].count()/2)
+            anyhours[key].append(pageinfo['anyhours'][key])
 
-        hoursworkedinaday.append(hoursworked)
+        gantts.append(pageinfo['gantt'])
+
+    # Convert the hours of rest to numbers once all pages are collected
+    for key in anyhours.keys():
+        for j in range(len(anyhours[key])):
+            anyhours[key][j] = [float(x) if x != 'N/A' else 'N/A' for x in anyhours[key][j]]
+
+    # Stack the gantt data of all pages into a single (total days)x48 array, with the page and day of each row
+    ganttdata = np.concatenate([gantt.values for gantt in gantts], axis=0)
+    numberofdays = np.array([len(gantt) for gantt in gantts])
+    pageids = np.repeat(np.arange(len(gantts)), numberofdays)
+    dayids = np.arange(len(ganttdata)) - np.repeat(np.cumsum(numberofdays) - numberofdays, numberofdays)
+
+    # Each gantt cell is half an hour, so the hours worked in a day are half the sum of its row
+    hoursworkedinaday = np.full((len(gantts), numberofdays.max()), np.nan)
+    hoursworkedinaday[pageids, dayids] = ganttdata.sum(axis=1) / 2
+    hoursworkedinaday = pd.DataFrame(hoursworkedinaday)
 
 
     header = pd.DataFrame(header)
@@ -170,14 +235,13 @@ def report_average_hours(header, hoursworkedinaday, month):
 
     Args:
         header (dict): A dictionary containing header information.
-        hoursworkedinaday (list): A list of hours worked in a day.
+        hoursworkedinaday (pandas.DataFrame): DataFrame containing hours worked per day.
         month (str): The month for which the report is generated.
 
     Returns:
         tuple: A tuple containing the positions and their corresponding average hours worked.
     """
-    hoursworkedinaday = pd.DataFrame(hoursworkedinaday)
-    means = hoursworkedinaday[header['Period'] == month].T.mean()
+    means = hoursworkedinaday[header['Period'] == month].mean(axis=1)
     positions = header['Position'][header['Period'] == month]
 
     plt.figure(figsize=(20, 7))  # Increase the size of the figure
@@ -192,7 +256,7 @@ def report_average_hours(header, hoursworkedinaday, month):
     writer = pd.ExcelWriter(f'{header["Vessel"][0]} {month} average hours by positions.xlsx', engine='xlsxwriter')
     df = pd.DataFrame({'Position': positions, 'Average Hours Worked': means})
     df.to_excel(writer, sheet_name=f'{header["Vessel"][0]} {month}', index=False)
-    writer.save()
+    writer.close()
 
     return positions, means
 
@@ -203,21 +267,20 @@ def report_overtime_monthly(header, hoursworkedinaday, limit):
 
     Args:
         header (dict): A dictionary containing header information.
-        hoursworkedinaday (list): A list of hours worked per day.
+        hoursworkedinaday (pandas.DataFrame): DataFrame containing hours worked per day.
         limit (int): The maximum number of hours considered as regular working hours.
 
     Returns:
         tuple: A tuple containing the months, overtime hours, and total hours worked.
     """
     months = [i for i in range (1, 13)]
-    overtimes = []
-    totalhoursworked = []
-    hoursworkedinaday = pd.DataFrame(hoursworkedinaday)
-    for month in months:
-        hoursworked = hoursworkedinaday[header['Period'] == month].T
-        totalhoursworked.append(hoursworked.sum().sum())
-        overtime = hoursworked[hoursworked > limit] - limit
-        overtimes.append(overtime.sum().sum())
+
+    # total and overtime hours of each page, summed up by month
+    totals = hoursworkedinaday.sum(axis=1)
+    overtime = (hoursworkedinaday - limit).clip(lower=0).sum(axis=1)
+    periods = pd.Categorical(header['Period'], categories=months)
+    totalhoursworked = totals.groupby(periods, observed=False).sum().tolist()
+    overtimes = overtime.groupby(periods, observed=False).sum().tolist()
 
     # plot overtimes
     plt.figure(figsize=(20, 7))  # Increase the size of the figure
@@ -231,7 +294,7 @@ def report_overtime_monthly(header, hoursworkedinaday, limit):
     writer = pd.ExcelWriter(f'{header["Vessel"][0]} overtime by month over {limit} hours.xlsx', engine='xlsxwriter')
     df = pd.DataFrame({'Month': months, 'Overtime': overtimes, 'Total Hours Worked': totalhoursworked})
     df.to_excel(writer, sheet_name=f'{header["Vessel"][0]}', index=False)
-    writer.save()
+    writer.close()
 
     return months, overtimes, totalhoursworked
 
@@ -250,16 +313,12 @@ def report_overtime_bypositions(header, hoursworkedinaday, limit):
 
     """
     positions = header['Position'].unique()
-    totalhoursworked = []
-    overtimes = []
-    hoursworkedinaday = pd.DataFrame(hoursworkedinaday)
-    
-    for position in positions:
-        hoursworked = hoursworkedinaday[header['Position'] == position].T
-        totalhoursworked.append(hoursworked.sum().sum())
-        overtime = hoursworked[hoursworked > limit] - limit
-        overtimes.append(overtime.sum().sum())
 
+    # total and overtime hours of each page, summed up by position
+    totals = hoursworkedinaday.sum(axis=1)
+    overtime = (hoursworkedinaday - limit).clip(lower=0).sum(axis=1)
+    totalhoursworked = totals.groupby(header['Position']).sum().reindex(positions).tolist()
+    overtimes = overtime.groupby(header['Position']).sum().reindex(positions).tolist()
 
     # plot overtimes
     plt.figure(figsize=(20, 7))  # Increase the size of the figure
@@ -273,7 +332,7 @@ def report_overtime_bypositions(header, hoursworkedinaday, limit):
     writer = pd.ExcelWriter(f'{header["Vessel"][0]} overtime by positions over {limit} hours.xlsx', engine='xlsxwriter')
     df = pd.DataFrame({'Position': positions, 'Overtime': overtimes, 'Total Hours Worked': totalhoursworked})
     df.to_excel(writer, sheet_name=f'{header["Vessel"][0]}', index=False)
-    writer.save()
+    writer.close()
 
     return positions, overtimes, totalhoursworked
 
@@ -297,36 +356,25 @@ def report_overtime_bypositions_monthly(header, hoursworkedinaday, limit):
     months = [i for i in range (1, 13)]
     positions = header['Position'].unique()
     
-    hoursworkedinaday = pd.DataFrame(hoursworkedinaday)
+    # total and overtime hours of each page, summed up by position and month
+    totals = hoursworkedinaday.sum(axis=1)
+    overtime = (hoursworkedinaday - limit).clip(lower=0).sum(axis=1)
+    groups = [header['Position'], header['Period']]
 
-    monthly_totalhoursworked = []
-    monthly_overtimes = []
+    monthly_totalhoursworked = totals.groupby(groups).sum().unstack(fill_value=0)
+    monthly_overtimes = overtime.groupby(groups).sum().unstack(fill_value=0)
 
-    for month in months:
-        totalhoursworked = []
-        overtimes = []
-        for position in positions:
-            hoursworked = hoursworkedinaday[(header['Period'] == month) & (header['Position'] == position)]
-            totalhoursworked.append(hoursworked.sum().sum())
-            overtime = hoursworked[hoursworked >= limit] - limit
-            overtimes.append(overtime.sum().sum())
-        monthly_totalhoursworked.append(totalhoursworked)
-        monthly_overtimes.append(overtimes)
+    monthly_totalhoursworked = monthly_totalhoursworked.reindex(index=positions, columns=months, fill_value=0).astype(float)
+    monthly_overtimes = monthly_overtimes.reindex(index=positions, columns=months, fill_value=0).astype(float)
 
-    monthly_overtimes = pd.DataFrame(monthly_overtimes).T
-    monthly_totalhoursworked = pd.DataFrame(monthly_totalhoursworked).T
-
-    monthly_overtimes.columns = months
-    monthly_overtimes.index = positions
-
-    monthly_totalhoursworked.columns = months
-    monthly_totalhoursworked.index = positions
+    monthly_totalhoursworked = monthly_totalhoursworked.rename_axis(index=None, columns=None)
+    monthly_overtimes = monthly_overtimes.rename_axis(index=None, columns=None)
 
     # make excel file with months and overtimes
     writer = pd.ExcelWriter(f'{header["Vessel"][0]} overtime by positions and months over {limit} hours.xlsx', engine='xlsxwriter')
     monthly_overtimes.to_excel(writer, sheet_name=f'Overtimes')
     monthly_totalhoursworked.to_excel(writer, sheet_name=f'Total Hours Worked')
-    writer.save()
+    writer.close()
 
     return monthly_overtimes, monthly_totalhoursworked
 
@@ -340,17 +388,12 @@ def clean_anyhours(anyhours):
         anyhours (dict): A dictionary containing the 'Hours of rest' values.
     """
 
-    # replace 'N/A' with 24 in anyhours['Hours of rest in any 24h']
-    for i in range(len(anyhours['Hours of rest in any 24h'])):
-        for j in range(len(anyhours['Hours of rest in any 24h'][i])):
-            if anyhours['Hours of rest in any 24h'][i][j] == 'N/A':
-                anyhours['Hours of rest in any 24h'][i][j] = 24
-
-    # replace 'N/A' with 77 in anyhours['Hours of rest in any 7d']
-    for i in range(len(anyhours['Hours of rest in any 7d'])):
-        for j in range(len(anyhours['Hours of rest in any 7d'][i])):
-            if anyhours['Hours of rest in any 7d'][i][j] == 'N/A':
-                anyhours['Hours of rest in any 7d'][i][j] = 168
+    # replace 'N/A' with 24 in anyhours['Hours of rest in any 24h'] and with 168 in anyhours['Hours of rest in any 7d']
+    fills = {'Hours of rest in any 24h': 24, 'Hours of rest in any 7d': 168}
+    for key, fill in fills.items():
+        for i, row in enumerate(anyhours[key]):
+            row = np.array(row, dtype=object)
+            anyhours[key][i] = np.where(row == 'N/A', fill, row).astype(float)
 
 
 def plot_violations(anyhours, header, dayorweek, limit):
@@ -369,16 +412,15 @@ def plot_violations(anyhours, header, dayorweek, limit):
     """
     months = [i for i in range (1, 13)]
 
-    # for month in months:
-    violations = []
-    anyhours = pd.DataFrame(anyhours)
-    for month in months:
-        hoursrested = pd.Series(anyhours[dayorweek][header['Period'] == month])
-        violation = 0
-        for page in hoursrested:
-            page = pd.Series(page)
-            violation += page[page < limit].count()
-        violations.append(violation)
+    # pad the pages with NaN to the same number of days, so all pages are compared at once
+    pages = anyhours[dayorweek]
+    maxdays = max(len(page) for page in pages)
+    hoursrested = np.array([np.pad(np.asarray(page, dtype=float), (0, maxdays - len(page)), constant_values=np.nan) for page in pages])
+
+    # count the days under the limit on each page and sum them up by month
+    violationsperpage = pd.Series((hoursrested < limit).sum(axis=1))
+    periods = pd.Categorical(header['Period'], categories=months)
+    violations = violationsperpage.groupby(periods, observed=False).sum().tolist()
 
     # plot violations
     plt.figure(figsize=(20, 7))  # Increase the size of the figure
@@ -411,18 +453,15 @@ def report_violations(anyhours, header):
     violationsinday = plot_violations(anyhours, header, 'Hours of rest in any 24h', 10)
     violationsinweek = plot_violations(anyhours, header, 'Hours of rest in any 7d', 77)
 
-    totaldaysworked_list = []
-    for month in months:
-        endday = header['EndDay'][header['Period'] == month]
-        startday = header['StartDay'][header['Period'] == month]
-        totaldaysworked = (endday - startday + 1).sum()
-        totaldaysworked_list.append(totaldaysworked)
+    periods = pd.Categorical(header['Period'], categories=months)
+    daysworked = header['EndDay'] - header['StartDay'] + 1
+    totaldaysworked_list = daysworked.groupby(periods, observed=False).sum().tolist()
 
     # make excel file with months and violations
     writer = pd.ExcelWriter(f"{header['Vessel'][0]} violations by month.xlsx", engine='xlsxwriter')
     df = pd.DataFrame({'Month': months, 'Violations in any 24h': violationsinday, 'Violations in any 7d': violationsinweek, 'Total Days Worked': totaldaysworked_list})
     df.to_excel(writer, sheet_name=f"{header['Vessel'][0]}", index=False)
-    writer.save()
+    writer.close()
     return violationsinday, violationsinweek, totaldaysworked_list
 
 
@@ -432,7 +471,7 @@ def mean_std_per_seafarer(header, hoursworkedinaday):
 
     Args:
         header (pandas.DataFrame): DataFrame containing the header information.
-        hoursworkedinaday (list): List of lists containing the hours worked by each seafarer.
+        hoursworkedinaday (pandas.DataFrame): DataFrame containing hours worked per day.
 
     Returns:
         tuple: A tuple containing three lists - means, stds, and numberofdays.
@@ -441,23 +480,20 @@ def mean_std_per_seafarer(header, hoursworkedinaday):
             - numberofdays (list): List of the number of days worked for each seafarer.
     """
 
-    hoursworkedinaday = pd.DataFrame(hoursworkedinaday)
-    means = []
-    stds = []
-    numberofdays = []
-    for seafarer in header['Seafarer'].unique():
-        # merge the listof lists hoursworkedinaday[header['Seafarer'] == seafarer] into a single list
-        merged_list = [item for sublist in hoursworkedinaday[header['Seafarer'] == seafarer].values for item in sublist]
-        merged_list = pd.Series(merged_list)
+    seafarers = header['Seafarer'].unique()
 
-        means.append(merged_list.mean())
-        stds.append(merged_list.std())
+    # hours worked of every day in a single Series, grouped by the seafarer of its page
+    hoursworked = hoursworkedinaday.stack()
+    pages = hoursworked.index.get_level_values(0)
+    stats = hoursworked.groupby(header['Seafarer'].loc[pages].values).agg(['mean', 'std', 'count']).reindex(seafarers)
 
-        numberofdays.append(merged_list.count())
+    means = stats['mean'].tolist()
+    stds = stats['std'].tolist()
+    numberofdays = stats['count'].tolist()
 
     # create excel file with seafarer, mean, and std
     writer = pd.ExcelWriter(f'{header["Vessel"][0]} mean and std of each seafarer.xlsx', engine='xlsxwriter')
-    df = pd.DataFrame({'Seafarer': header['Seafarer'].unique(), 'Mean': means, 'Std': stds, 'Number of Days': numberofdays})
+    df = pd.DataFrame({'Seafarer': seafarers, 'Mean': means, 'Std': stds, 'Number of Days': numberofdays})
     df.to_excel(writer, sheet_name='Sheet1', index=False)
-    writer.save()
+    writer.close()
     return means, stds, numberofdays